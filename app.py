@@ -1,16 +1,43 @@
-from flask import Flask, request, send_file, render_template, jsonify
-from csv_processor import process_file, generate_csv, get_initial_product_info, convert_to_odoo, get_excel_sheet_names, generate_xlsx, convert_to_odoo_xlsx, generate_stock_move
+from flask import Flask, request, send_file, send_from_directory, render_template, jsonify, abort
+from csv_processor import process_file, generate_csv, get_initial_product_info, convert_to_odoo, get_excel_sheet_names, generate_xlsx, convert_to_odoo_xlsx, generate_stock_move, parse_location_split, ValidationError, DEFAULT_MAX_VALIDATION_ERRORS
 import io
 import os
+import time
+import threading
+import functools
 import traceback
 import logging
 import mimetypes
 import pandas as pd
+from request_profiler import SamplingProfiler, save_profile
+from artifact_cache import ArtifactCache, make_cache_key
 from openpyxl import Workbook
 
 
 app = Flask(__name__)
 
+# Number of invalid input rows reported before a file is rejected outright
+app.config['VALIDATION_MAX_ERRORS'] = int(os.environ.get('VALIDATION_MAX_ERRORS', DEFAULT_MAX_VALIDATION_ERRORS))
+
+# Admission control: memory budget shared by in-flight uploads, and how long requests may queue for it
+app.config['MEMORY_BUDGET_MB'] = int(os.environ.get('MEMORY_BUDGET_MB', 1024))
+app.config['ADMISSION_MAX_QUEUE'] = int(os.environ.get('ADMISSION_MAX_QUEUE', 16))
+app.config['ADMISSION_MAX_WAIT'] = float(os.environ.get('ADMISSION_MAX_WAIT', 30))
+app.config['ADMISSION_RETRY_AFTER'] = int(os.environ.get('ADMISSION_RETRY_AFTER', 10))
+
+# Opt-in profiling: requests sent with an "X-Profile: 1" header or "?profile=1" are sampled when enabled
+app.config['PROFILING_ENABLED'] = os.environ.get('PROFILING_ENABLED', '').lower() in ('1', 'true', 'yes')
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+app.config['PROFILE_RETENTION'] = int(os.environ.get('PROFILE_RETENTION', 20))
+app.config['PROFILE_SAMPLE_INTERVAL_MS'] = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', 5))
+
+# Generated files are cached on disk by input content and form parameters; 0 MB disables the cache
+app.config['ARTIFACT_CACHE_DIR'] = os.environ.get('ARTIFACT_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'artifact_cache'))
+app.config['ARTIFACT_CACHE_MAX_MB'] = int(os.environ.get('ARTIFACT_CACHE_MAX_MB', 256))
+
+# Leading bytes of a CSV read to build the product info preview
+app.config['PREVIEW_MAX_BYTES'] = int(os.environ.get('PREVIEW_MAX_BYTES', 256 * 1024))
+
 logging.basicConfig(
     level=logging.DEBUG,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -40,11 +67,189 @@ def get_file_type(filename):
     print(f"Unrecognized file type for filename: {filename}, mime type: {mime_type}")
     return None
 
+# Approximate peak memory per uploaded byte. CSV is held as bytes, decoded text and parsed rows;
+# xlsx is a compressed archive whose parsed cells take far more room than the upload itself.
+MEMORY_COST_FACTORS = {'csv': 6, 'xlsx': 40}
+DEFAULT_MEMORY_COST_FACTOR = 40
+
+
+class AdmissionController:
+    """Admits requests in arrival order while their estimated memory fits the budget.
+
+    Requests that do not fit wait in a bounded queue for up to `max_wait` seconds.
+    A single request larger than the whole budget is admitted once nothing else is running.
+    """
+
+    def __init__(self, budget_bytes, max_queue, max_wait):
+        self.budget_bytes = budget_bytes
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._condition = threading.Condition()
+        self._waiting = []
+        self.in_use_bytes = 0
+        self.active = 0
+        self.admitted_total = 0
+        self.rejected_total = 0
+        self.max_queue_depth = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def estimate_cost(self, upload_size, file_type):
+        return upload_size * MEMORY_COST_FACTORS.get(file_type, DEFAULT_MEMORY_COST_FACTOR)
+
+    def _fits(self, cost):
+        return self.active == 0 or self.in_use_bytes + cost <= self.budget_bytes
+
+    def acquire(self, cost):
+        """Block until `cost` bytes can be reserved. Returns False if the request was turned away."""
+        cost = min(cost, self.budget_bytes)
+        with self._condition:
+            if not self._waiting and self._fits(cost):
+                self._admit(cost, 0.0)
+                return True
+            if len(self._waiting) >= self.max_queue:
+                self.rejected_total += 1
+                return False
+
+            ticket = object()
+            self._waiting.append(ticket)
+            self.max_queue_depth = max(self.max_queue_depth, len(self._waiting))
+            start = time.monotonic()
+            try:
+                while self._waiting[0] is not ticket or not self._fits(cost):
+                    remaining = start + self.max_wait - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected_total += 1
+                        return False
+                    self._condition.wait(remaining)
+                self._admit(cost, time.monotonic() - start)
+                return True
+            finally:
+                self._waiting.remove(ticket)
+                # The next request in line may now be at the head of the queue
+                self._condition.notify_all()
+
+    def _admit(self, cost, waited):
+        self.in_use_bytes += cost
+        self.active += 1
+        self.admitted_total += 1
+        self.total_wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def release(self, cost):
+        cost = min(cost, self.budget_bytes)
+        with self._condition:
+            self.in_use_bytes -= cost
+            self.active -= 1
+            self._condition.notify_all()
+
+    def metrics(self):
+        with self._condition:
+            return {
+                'budget_bytes': self.budget_bytes,
+                'in_use_bytes': self.in_use_bytes,
+                'active_requests': self.active,
+                'queue_depth': len(self._waiting),
+                'max_queue_depth': self.max_queue_depth,
+                'admitted_total': self.admitted_total,
+                'rejected_total': self.rejected_total,
+                'average_wait_seconds': self.total_wait_seconds / self.admitted_total if self.admitted_total else 0.0,
+                'max_wait_seconds': self.max_wait_seconds
+            }
+
+
+admission_controller = AdmissionController(
+    app.config['MEMORY_BUDGET_MB'] * 1024 * 1024,
+    app.config['ADMISSION_MAX_QUEUE'],
+    app.config['ADMISSION_MAX_WAIT']
+)
+
+def get_upload_size(file):
+    file.stream.seek(0, os.SEEK_END)
+    size = file.stream.tell()
+    file.stream.seek(0)
+    return size
+
+def admission_controlled(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        file = request.files.get('file')
+        if file is None or file.filename == '':
+            # Nothing to load; let the view report the missing file
+            return view(*args, **kwargs)
+
+        cost = admission_controller.estimate_cost(get_upload_size(file), get_file_type(file.filename))
+        if not admission_controller.acquire(cost):
+            app.logger.warning(f"Rejected {request.path} for {file.filename}: memory budget exhausted")
+            response = jsonify({'error': 'The server is busy processing other files. Please try again shortly.'})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(app.config['ADMISSION_RETRY_AFTER'])
+            return response
+        try:
+            return view(*args, **kwargs)
+        finally:
+            admission_controller.release(cost)
+    return wrapper
+
+def profiling_requested():
+    if not app.config['PROFILING_ENABLED']:
+        return False
+    flag = request.headers.get('X-Profile') or request.args.get('profile', '')
+    return flag.lower() in ('1', 'true', 'yes')
+
+def profiled(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not profiling_requested():
+            return view(*args, **kwargs)
+
+        with SamplingProfiler(app.config['PROFILE_SAMPLE_INTERVAL_MS'] / 1000) as profiler:
+            response = app.make_response(view(*args, **kwargs))
+        try:
+            filename = save_profile(profiler, app.config['PROFILE_DIR'], request.endpoint, app.config['PROFILE_RETENTION'])
+        except OSError as e:
+            app.logger.error(f"Could not save profile for {request.path}: {str(e)}")
+            return response
+        app.logger.info(f"Profiled {request.path} in {profiler.duration:.3f}s: {filename}")
+        response.headers['X-Profile-URL'] = f"/profiles/{filename}"
+        return response
+    return wrapper
+
+OUTPUT_MIMETYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+}
+
+artifact_cache = ArtifactCache(app.config['ARTIFACT_CACHE_DIR'], app.config['ARTIFACT_CACHE_MAX_MB'] * 1024 * 1024)
+
+def send_artifact(cache_key, build, output_format, download_name):
+    """Send the generated file for `cache_key`, calling `build()` for its bytes only on a cache miss."""
+    body = artifact_cache.open(cache_key)
+    if body is not None:
+        app.logger.debug(f"Serving {download_name} from artifact cache")
+    else:
+        data = build()
+        try:
+            artifact_cache.put(cache_key, data)
+        except OSError as e:
+            app.logger.error(f"Could not cache {download_name}: {str(e)}")
+        body = io.BytesIO(data)
+
+    return send_file(
+        body,
+        mimetype=OUTPUT_MIMETYPES[output_format],
+        as_attachment=True,
+        download_name=download_name,
+        etag=cache_key
+    )
+
 @app.route('/', methods=['GET'])
 def index():
     return render_template('index.html')
 
 @app.route('/get_product_info', methods=['POST'])
+@admission_controlled
+@profiled
 def get_product_info():
     try:
         if 'file' not in request.files:
@@ -54,14 +259,20 @@ def get_product_info():
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
         if file:
-            file_content = file.read()
             file_type = get_file_type(file.filename)
             app.logger.debug(f"File type detected: {file_type}")
             if file_type not in ['csv', 'xlsx']:
                 return jsonify({'error': f'Unsupported file type: {file_type}'}), 400
+            partial = request.form.get('partial') == '1'
+            if file_type == 'csv':
+                # The header and first rows are all the preview needs
+                file_content = file.read(app.config['PREVIEW_MAX_BYTES'])
+                partial = partial or file.read(1) != b''
+            else:
+                file_content = file.read()
             try:
-                product_name, product_sku_base = get_initial_product_info(file_content, file_type, sheet_name)
-                return jsonify({'product_name': product_name, 'product_sku_base': product_sku_base})
+                product_info = get_initial_product_info(file_content, file_type, sheet_name, partial)
+                return jsonify(product_info)
             except Exception as e:
                 app.logger.error(f"Error in get_initial_product_info: {str(e)}")
                 app.logger.error(traceback.format_exc())
@@ -73,6 +284,7 @@ def get_product_info():
         return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
     
 @app.route('/get_excel_sheets', methods=['POST'])
+@admission_controlled
 def get_excel_sheets():
     try:
         if 'file' not in request.files:
@@ -100,6 +312,8 @@ def get_excel_sheets():
         return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
 
 @app.route('/process', methods=['POST'])
+@admission_controlled
+@profiled
 def process():
     try:
         if 'file' not in request.files:
@@ -128,28 +342,38 @@ def process():
             
             if file_type not in ['csv', 'xlsx']:
                 return jsonify({'error': f'Unsupported file type: {file_type}'}), 400
-            try:
-                processed_data = process_file(file_content, file_type, product_name, product_sku_base, default_price, wholesale_price, consignment_price, cost, weight, brand, gender, suppliers, sheet_name)
-                output_format = request.form.get('output_format', 'csv')
-                
+            output_format = request.form.get('output_format', 'csv')
+            if output_format not in OUTPUT_MIMETYPES:
+                return jsonify({'error': 'Unsupported output format'}), 400
+
+            cache_key = make_cache_key(file_content, {
+                'route': 'process',
+                'file_type': file_type,
+                'output_format': output_format,
+                'product_name': product_name,
+                'product_sku_base': product_sku_base,
+                'default_price': default_price,
+                'wholesale_price': wholesale_price,
+                'consignment_price': consignment_price,
+                'cost': cost,
+                'weight': weight,
+                'brand': brand,
+                'gender': gender,
+                'suppliers': suppliers,
+                'sheet_name': sheet_name or ''
+            })
+
+            def build():
+                processed_data = process_file(file_content, file_type, product_name, product_sku_base, default_price, wholesale_price, consignment_price, cost, weight, brand, gender, suppliers, sheet_name, app.config['VALIDATION_MAX_ERRORS'])
                 if output_format == 'csv':
-                    output_csv = generate_csv(processed_data)
-                    return send_file(
-                        io.BytesIO(output_csv.encode()),
-                        mimetype='text/csv',
-                        as_attachment=True,
-                        download_name='processed_inventory.csv'
-                    )
-                elif output_format == 'xlsx':
-                    output_xlsx = generate_xlsx(processed_data)
-                    return send_file(
-                        output_xlsx,
-                        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                        as_attachment=True,
-                        download_name='processed_inventory.xlsx'
-                    )
-                else:
-                    return jsonify({'error': 'Unsupported output format'}), 400
+                    return generate_csv(processed_data).encode()
+                return generate_xlsx(processed_data).getvalue()
+
+            try:
+                return send_artifact(cache_key, build, output_format, f'processed_inventory.{output_format}')
+            except ValidationError as e:
+                app.logger.warning(f"Rejected invalid file {file.filename}: {str(e)}")
+                return jsonify({'error': f'Invalid file: {str(e)}', 'validation_errors': e.errors}), 400
             except Exception as e:
                 app.logger.error(f"Error processing file: {str(e)}")
                 app.logger.error(traceback.format_exc())
@@ -162,6 +386,8 @@ def process():
         return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
     
 @app.route('/convert_to_odoo', methods=['POST'])
+@admission_controlled
+@profiled
 def convert_to_odoo_route():
     primary_category = request.form.get('primaryCategory', '')
     secondary_category = request.form.get('secondaryCategory', '')
@@ -178,26 +404,27 @@ def convert_to_odoo_route():
             file_type = get_file_type(file.filename)
             if file_type not in ['csv', 'xlsx']:
                 return jsonify({'error': 'Unsupported file type'}), 400
-            try:
-                output_format = request.form.get('output_format', 'csv')
+            output_format = request.form.get('output_format', 'csv')
+            if output_format not in OUTPUT_MIMETYPES:
+                return jsonify({'error': 'Unsupported output format'}), 400
+
+            # Categories only appear lowercased in the output
+            cache_key = make_cache_key(file_content, {
+                'route': 'convert_to_odoo',
+                'file_type': file_type,
+                'output_format': output_format,
+                'primary_category': primary_category.lower(),
+                'secondary_category': secondary_category.lower(),
+                'tertiary_category': tertiary_category.lower()
+            })
+
+            def build():
                 if output_format == 'csv':
-                    odoo_csv = convert_to_odoo(file_content, file_type, primary_category, secondary_category, tertiary_category)
-                    return send_file(
-                        io.BytesIO(odoo_csv.encode()),
-                        mimetype='text/csv',
-                        as_attachment=True,
-                        download_name='odoo_inventory.csv'
-                    )
-                elif output_format == 'xlsx':
-                    odoo_xlsx = convert_to_odoo_xlsx(file_content, file_type, primary_category, secondary_category, tertiary_category)
-                    return send_file(
-                        odoo_xlsx,
-                        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                        as_attachment=True,
-                        download_name='odoo_inventory.xlsx'
-                    )
-                else:
-                    return jsonify({'error': 'Unsupported output format'}), 400
+                    return convert_to_odoo(file_content, file_type, primary_category, secondary_category, tertiary_category).encode()
+                return convert_to_odoo_xlsx(file_content, file_type, primary_category, secondary_category, tertiary_category).getvalue()
+
+            try:
+                return send_artifact(cache_key, build, output_format, f'odoo_inventory.{output_format}')
             except Exception as e:
                 app.logger.error(f"Error converting to Odoo format: {str(e)}")
                 app.logger.error(traceback.format_exc())
@@ -209,6 +436,8 @@ def convert_to_odoo_route():
         return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
     
 @app.route('/generate_stock_move', methods=['POST'])
+@admission_controlled
+@profiled
 def generate_stock_move_route():
     try:
         if 'file' not in request.files:
@@ -223,36 +452,45 @@ def generate_stock_move_route():
                 return jsonify({'error': 'Unsupported file type'}), 400
             
             location = request.form.get('location', '')
-            if not location:
+            location_column = request.form.get('location_column', '').strip()
+            location_split_rule = request.form.get('location_split', '').strip()
+            if not (location or location_column or location_split_rule):
                 return jsonify({'error': 'Location not provided'}), 400
+            if location_column and location_split_rule:
+                return jsonify({'error': 'Use either a location column or a location split, not both'}), 400
+            location_split = None
+            if location_split_rule:
+                try:
+                    location_split = parse_location_split(location_split_rule)
+                except ValueError as e:
+                    return jsonify({'error': str(e)}), 400
 
-            try:
-                output_format = request.form.get('output_format', 'csv')
-                stock_move_data = generate_stock_move(file_content, file_type, location)
-                
+            output_format = request.form.get('output_format', 'csv')
+            if output_format not in OUTPUT_MIMETYPES:
+                return jsonify({'error': 'Unsupported output format'}), 400
+
+            cache_key = make_cache_key(file_content, {
+                'route': 'generate_stock_move',
+                'file_type': file_type,
+                'output_format': output_format,
+                'location': location,
+                'location_column': location_column,
+                'location_split': location_split or {}
+            })
+
+            def build():
+                stock_move_data = generate_stock_move(file_content, file_type, location, location_column or None, location_split)
                 if output_format == 'csv':
                     output = io.StringIO()
                     stock_move_data.to_csv(output, index=False)
-                    output.seek(0)
-                    return send_file(
-                        io.BytesIO(output.getvalue().encode()),
-                        mimetype='text/csv',
-                        as_attachment=True,
-                        download_name='odoo_stock_move.csv'
-                    )
-                elif output_format == 'xlsx':
-                    output = io.BytesIO()
-                    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                        stock_move_data.to_excel(writer, index=False)
-                    output.seek(0)
-                    return send_file(
-                        output,
-                        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                        as_attachment=True,
-                        download_name='odoo_stock_move.xlsx'
-                    )
-                else:
-                    return jsonify({'error': 'Unsupported output format'}), 400
+                    return output.getvalue().encode()
+                output = io.BytesIO()
+                with pd.ExcelWriter(output, engine='openpyxl') as writer:
+                    stock_move_data.to_excel(writer, index=False)
+                return output.getvalue()
+
+            try:
+                return send_artifact(cache_key, build, output_format, f'odoo_stock_move.{output_format}')
             except Exception as e:
                 app.logger.error(f"Error generating stock move: {str(e)}")
                 app.logger.error(traceback.format_exc())
@@ -263,5 +501,15 @@ def generate_stock_move_route():
         app.logger.error(traceback.format_exc())
         return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
 
+@app.route('/metrics/admission', methods=['GET'])
+def admission_metrics():
+    return jsonify(admission_controller.metrics())
+
+@app.route('/profiles/<path:filename>', methods=['GET'])
+def download_profile(filename):
+    if not app.config['PROFILING_ENABLED']:
+        abort(404)
+    return send_from_directory(app.config['PROFILE_DIR'], filename, as_attachment=True, mimetype='text/plain')
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,77 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+
+# Bump when a change to the converters alters their output, so stale artifacts are not served
+CACHE_VERSION = 1
+
+
+def make_cache_key(file_content, params):
+    """Key an output artifact by the uploaded file's content and the form parameters that shape it."""
+    digest = hashlib.sha256()
+    digest.update(file_content)
+    digest.update(json.dumps({'version': CACHE_VERSION, 'params': params}, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class ArtifactCache:
+    """Size-bounded on-disk cache of generated files, evicting the least recently used first.
+
+    A cache with `max_bytes` of 0 stores nothing.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def open(self, key):
+        """Return the cached artifact for `key` opened for reading, or None on a miss."""
+        path = self._path(key)
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return None
+        try:
+            # The modification time doubles as the last access time for eviction
+            os.utime(path)
+        except OSError:
+            pass
+        return f
+
+    def put(self, key, data):
+        if self.max_bytes <= 0 or len(data) > self.max_bytes:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and not entry.name.startswith('.tmp-'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
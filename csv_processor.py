@@ -1,6 +1,7 @@
 import csv
 import io
 import re
+import itertools
 import pandas as pd
 import traceback
 from openpyxl import load_workbook, Workbook
@@ -15,38 +16,167 @@ OUTPUT_SIZE_MAP = {'XS': 'XSmall', 'SM': 'Small', 'MD': 'Medium', 'LG': 'Large',
 # Reverse map for converting full size to short code
 REVERSE_OUTPUT_SIZE_MAP = {v: k for k, v in OUTPUT_SIZE_MAP.items()}
 
+# Columns process_data reads from every input row
+REQUIRED_COLUMNS = ['Product SKU', 'Product Name', 'Price', 'MPN', 'Stock', 'GTIN', 'Status']
 
-def process_file(file_content, file_type, product_name, product_sku_base, default_price, wholesale_price, consignment_price, cost, weight, brand, gender, suppliers, sheet_name=None):
+# Number of invalid rows collected before validation gives up on the file
+DEFAULT_MAX_VALIDATION_ERRORS = 50
+
+# Rows returned with the product info preview
+PREVIEW_SAMPLE_ROWS = 5
+
+SIZE_PATTERN = re.compile(r'\[S\]Size=(.*?)(?=\s|$)')
+
+
+class ValidationError(Exception):
+    """Raised when an input file does not match the expected layout.
+
+    `errors` holds one entry per rejected row: {'line': <line number>, 'reasons': [...]}.
+    """
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+def process_file(file_content, file_type, product_name, product_sku_base, default_price, wholesale_price, consignment_price, cost, weight, brand, gender, suppliers, sheet_name=None, max_errors=DEFAULT_MAX_VALIDATION_ERRORS):
     try:
         if file_type == 'csv':
-            return process_csv(file_content, product_name, product_sku_base, default_price, wholesale_price, consignment_price, cost, weight, brand, gender, suppliers)
+            return process_csv(file_content, product_name, product_sku_base, default_price, wholesale_price, consignment_price, cost, weight, brand, gender, suppliers, max_errors)
         elif file_type == 'xlsx':
-            return process_excel(file_content, product_name, product_sku_base, default_price, wholesale_price, consignment_price, cost, weight, brand, gender, suppliers, sheet_name)
+            return process_excel(file_content, product_name, product_sku_base, default_price, wholesale_price, consignment_price, cost, weight, brand, gender, suppliers, sheet_name, max_errors)
         else:
             raise ValueError(f"Unsupported file type: {file_type}")
+    except ValidationError as e:
+        print(f"Validation failed in process_file: {str(e)}")
+        raise
     except Exception as e:
         print(f"Error in process_file: {str(e)}")
         traceback.print_exc()
         raise
     
-def process_csv(file_content, product_name, product_sku_base, default_price, wholesale_price, consignment_price, cost, weight, brand, gender, suppliers):
+def process_csv(file_content, product_name, product_sku_base, default_price, wholesale_price, consignment_price, cost, weight, brand, gender, suppliers, max_errors=DEFAULT_MAX_VALIDATION_ERRORS):
     reader = csv.DictReader(io.StringIO(file_content.decode('utf-8-sig')))
-    return process_data(reader, product_name, product_sku_base, default_price, wholesale_price, consignment_price, cost, weight, brand, gender, suppliers)
+    # line_num is read after each row, so blank lines and multi-line quoted cells are counted
+    numbered_rows = ((reader.line_num, row) for row in reader)
+    rows = validate_rows(numbered_rows, reader.fieldnames, max_errors)
+    return process_data(rows, product_name, product_sku_base, default_price, wholesale_price, consignment_price, cost, weight, brand, gender, suppliers)
+
+def process_excel(file_content, product_name, product_sku_base, default_price, wholesale_price, consignment_price, cost, weight, brand, gender, suppliers, sheet_name=None, max_errors=DEFAULT_MAX_VALIDATION_ERRORS):
+    # Read-only mode streams rows, so a bad header is caught before the rest of the sheet is parsed
+    wb = load_workbook(filename=io.BytesIO(file_content), read_only=True)
+    try:
+        if sheet_name:
+            if sheet_name not in wb.sheetnames:
+                raise ValueError(f"Sheet '{sheet_name}' not found in the workbook")
+            ws = wb[sheet_name]
+        else:
+            ws = wb.active
+        # Exporters sometimes write a stale <dimension>; read every row that is actually there
+        ws.reset_dimensions()
+
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, None)
+        # Blank rows are still yielded, so the index matches the sheet row
+        numbered_rows = ((row_index, excel_row_to_dict(header, row)) for row_index, row in enumerate(rows, start=2))
+        rows = validate_rows(numbered_rows, header, max_errors)
+        return process_data(rows, product_name, product_sku_base, default_price, wholesale_price, consignment_price, cost, weight, brand, gender, suppliers)
+    finally:
+        wb.close()
+
+def excel_row_to_dict(header, row):
+    # Without a stored dimension, rows stop at their last filled cell
+    return {column: row[index] if index < len(row) else None for index, column in enumerate(header)}
+
+def validate_header(header):
+    if not header:
+        raise ValidationError("The file is empty or has no header row")
+    missing = [column for column in REQUIRED_COLUMNS if column not in header]
+    if missing:
+        raise ValidationError(f"Missing required columns: {', '.join(missing)}")
+
+def get_row_errors(row, seen_product_row):
+    reasons = []
+    product_sku = row.get('Product SKU')
+    if not isinstance(product_sku, str) or not product_sku.strip():
+        return ['Product SKU is missing']
+
+    product_name = row.get('Product Name')
+    if not isinstance(product_name, str) or not product_name.strip():
+        reasons.append('Product Name is missing')
+
+    if not any(size in product_sku for size in INPUT_SIZE_MAP.keys()):
+        # Product row
+        price = row.get('Price')
+        if price is None:
+            reasons.append('Price is missing')
+        elif not isinstance(price, str):
+            reasons.append(f"Price must be text, got {price!r}")
+        return reasons
+
+    # Item row
+    if not seen_product_row:
+        reasons.append('Item row appears before any product row')
+    if isinstance(product_name, str) and not SIZE_PATTERN.search(product_name):
+        reasons.append("Product Name has no '[S]Size=' attribute")
+    mpn = row.get('MPN')
+    if not isinstance(mpn, str):
+        reasons.append(f"MPN must be text, got {mpn!r}")
+    stock = row.get('Stock')
+    if stock not in (None, ''):
+        try:
+            int(stock)
+        except (TypeError, ValueError):
+            reasons.append(f"Stock must be a whole number, got {stock!r}")
+    return reasons
+
+def validate_rows(numbered_rows, header, max_errors=DEFAULT_MAX_VALIDATION_ERRORS):
+    """Check the header up front, then yield the valid rows one at a time.
+
+    `numbered_rows` yields (line number in the file, row dict) pairs; the line number is
+    what the error report points to.
+
+    Invalid rows are recorded and skipped. A ValidationError is raised as soon as
+    `max_errors` rows have been rejected, or at the end of the input if any were.
+    """
+    validate_header(header)
+
+    errors = []
+    seen_product_row = False
+    # Line of the last product row that has not been followed by an item row yet
+    childless_product_line = None
+
+    def record_error(line_number, reasons):
+        errors.append({'line': line_number, 'reasons': reasons})
+        if len(errors) >= max_errors:
+            raise ValidationError(f"Aborted after {len(errors)} invalid rows (line {line_number})", errors)
+
+    for line_number, row in numbered_rows:
+        if all(value in (None, '') for value in row.values()):
+            continue
 
-def process_excel(file_content, product_name, product_sku_base, default_price, wholesale_price, consignment_price, cost, weight, brand, gender, suppliers, sheet_name=None):
-    wb = load_workbook(filename=io.BytesIO(file_content))
-    
-    if sheet_name:
-        if sheet_name not in wb.sheetnames:
-            raise ValueError(f"Sheet '{sheet_name}' not found in the workbook")
-        ws = wb[sheet_name]
-    else:
-        ws = wb.active
-    
-    rows = list(ws.iter_rows(values_only=True))
-    header = rows[0]
-    reader = [dict(zip(header, row)) for row in rows[1:]]
-    return process_data(reader, product_name, product_sku_base, default_price, wholesale_price, consignment_price, cost, weight, brand, gender, suppliers)
+        product_sku = row.get('Product SKU')
+        if isinstance(product_sku, str) and product_sku.strip():
+            if any(size in product_sku for size in INPUT_SIZE_MAP.keys()):
+                childless_product_line = None
+            elif childless_product_line is not None:
+                record_error(childless_product_line, ['Product has no item rows'])
+                childless_product_line = None
+
+        reasons = get_row_errors(row, seen_product_row)
+        if reasons:
+            record_error(line_number, reasons)
+            continue
+
+        if not any(size in product_sku for size in INPUT_SIZE_MAP.keys()):
+            seen_product_row = True
+            childless_product_line = line_number
+        yield row
+
+    if childless_product_line is not None:
+        errors.append({'line': childless_product_line, 'reasons': ['Product has no item rows']})
+    if errors:
+        raise ValidationError(f"Found {len(errors)} invalid rows", errors)
 
 def process_data(reader, product_name, product_sku_base, default_price, wholesale_price, consignment_price, cost, weight, brand, gender, suppliers):
     try:
@@ -81,7 +211,7 @@ def process_data(reader, product_name, product_sku_base, default_price, wholesal
             else:
                 # This is an item row
                 size_identifier = product_sku.split('-')[-1]
-                full_size = re.search(r'\[S\]Size=(.*?)(?=\s|$)', row['Product Name']).group(1)
+                full_size = SIZE_PATTERN.search(row['Product Name']).group(1)
                 input_size = INPUT_SIZE_MAP.get(size_identifier, full_size.split()[0])
                 
                 # Convert input size to output size
@@ -120,6 +250,8 @@ def process_data(reader, product_name, product_sku_base, default_price, wholesal
         
         return processed_data
     
+    except ValidationError:
+        raise
     except Exception as e:
         raise Exception(f"Error processing data: {str(e)}")
     
@@ -413,42 +545,71 @@ def get_excel_sheet_names(file_content):
     wb = load_workbook(filename=io.BytesIO(file_content))
     return wb.sheetnames
 
-def get_initial_product_info(file_content, file_type, sheet_name=None):
+def get_initial_product_info(file_content, file_type, sheet_name=None, partial=False):
+    """Return the product name, SKU base, column list and first few rows of an input file.
+
+    With `partial`, `file_content` is only the leading part of a CSV file and may end mid-line.
+    """
     if file_type == 'csv':
-        return get_initial_product_info_csv(file_content)
+        return get_initial_product_info_csv(file_content, partial)
     elif file_type == 'xlsx':
         return get_initial_product_info_excel(file_content, sheet_name)
     else:
         raise ValueError("Unsupported file type")
 
-def get_initial_product_info_csv(file_content):
+def build_product_preview(header, sample_rows):
+    if not sample_rows:
+        raise ValueError("No data rows found")
+    first_row = sample_rows[0]
+    return {
+        'product_name': first_row['Product Name'].split()[0],
+        'product_sku_base': first_row['Product SKU'].split('-')[0],
+        'columns': [str(column) for column in header if column is not None],
+        'sample_rows': [
+            {str(column): '' if value is None else str(value) for column, value in row.items() if column is not None}
+            for row in sample_rows
+        ]
+    }
+
+def get_initial_product_info_csv(file_content, partial=False):
     try:
+        if partial:
+            last_newline = file_content.rfind(b'\n')
+            if last_newline == -1:
+                raise ValueError(f"The header line is longer than the {len(file_content)} bytes received")
+            # Drop the line the slice was cut off in; a newline byte never falls inside a UTF-8 character
+            file_content = file_content[:last_newline + 1]
         reader = csv.DictReader(io.StringIO(file_content.decode('utf-8-sig')))
-        first_row = next(reader)
-        product_name = first_row['Product Name'].split()[0]
-        product_sku_base = first_row['Product SKU'].split('-')[0]
-        return product_name, product_sku_base
+        rows = list(itertools.islice(reader, PREVIEW_SAMPLE_ROWS + 1))
+        if partial and len(rows) <= PREVIEW_SAMPLE_ROWS:
+            # The last row read may be a record cut off inside a quoted cell that holds a newline
+            rows = rows[:-1]
+            if not rows:
+                raise ValueError(f"No complete data row in the first {len(file_content)} bytes received")
+        return build_product_preview(reader.fieldnames or [], rows[:PREVIEW_SAMPLE_ROWS])
     except Exception as e:
         raise Exception(f"Error getting initial product info from CSV: {str(e)}")
 
 def get_initial_product_info_excel(file_content, sheet_name=None):
     try:
-        wb = load_workbook(filename=io.BytesIO(file_content))
-        if sheet_name:
-            if sheet_name not in wb.sheetnames:
-                raise ValueError(f"Sheet '{sheet_name}' not found in the workbook")
-            ws = wb[sheet_name]
-        else:
-            ws = wb.active
-        
-        first_row = next(ws.iter_rows(values_only=True))
-        header = first_row
-        data_row = next(ws.iter_rows(values_only=True))
-        first_row_dict = dict(zip(header, data_row))
-        
-        product_name = first_row_dict['Product Name'].split()[0]
-        product_sku_base = first_row_dict['Product SKU'].split('-')[0]
-        return product_name, product_sku_base
+        wb = load_workbook(filename=io.BytesIO(file_content), read_only=True)
+        try:
+            if sheet_name:
+                if sheet_name not in wb.sheetnames:
+                    raise ValueError(f"Sheet '{sheet_name}' not found in the workbook")
+                ws = wb[sheet_name]
+            else:
+                ws = wb.active
+            # A stale <dimension> would otherwise cut off rows or columns
+            ws.reset_dimensions()
+
+            rows = ws.iter_rows(values_only=True)
+            header = next(rows, None) or []
+            filled_rows = (row for row in rows if any(value is not None for value in row))
+            sample_rows = [excel_row_to_dict(header, row) for row in itertools.islice(filled_rows, PREVIEW_SAMPLE_ROWS)]
+            return build_product_preview(header, sample_rows)
+        finally:
+            wb.close()
     except Exception as e:
         raise Exception(f"Error getting initial product info from Excel: {str(e)}")
     
@@ -497,29 +658,112 @@ def generate_xlsx(processed_data):
     output.seek(0)
     return output
 
-def generate_stock_move(file_content, file_type, location):
+def parse_location_split(text):
+    """Parse a split rule such as "KALLI/Stock=60, AGDM1/Stock=40" into an ordered {location: share} dict."""
+    split = {}
+    for part in text.split(','):
+        if not part.strip():
+            continue
+        location, separator, share = part.rpartition('=')
+        if not separator or not location.strip():
+            raise ValueError(f"Invalid location split entry: '{part.strip()}'")
+        try:
+            share = float(share)
+        except ValueError:
+            raise ValueError(f"Invalid share for location '{location.strip()}': '{share.strip()}'")
+        if share < 0:
+            raise ValueError(f"Share for location '{location.strip()}' cannot be negative")
+        split[location.strip()] = share
+    if not split or sum(split.values()) <= 0:
+        raise ValueError("Location split needs at least one location with a positive share")
+    return split
+
+def split_quantity(quantity, split, total_share):
+    # Largest remainder: floor every share, then hand the leftover units to the biggest fractions
+    shares = [(location, quantity * share / total_share) for location, share in split.items()]
+    allocation = {location: int(share) for location, share in shares}
+    leftover = quantity - sum(allocation.values())
+    for location, share in sorted(shares, key=lambda item: item[1] - int(item[1]), reverse=True)[:leftover]:
+        allocation[location] += 1
+    return allocation
+
+def location_suffix(location):
+    return re.sub(r'\W+', '_', location).strip('_').lower()
+
+def generate_stock_move(file_content, file_type, location='', location_column=None, location_split=None):
+    """Build Odoo stock move rows for every item with stock.
+
+    By default every row goes to `location`. With `location_column`, each row's location is read
+    from that column (falling back to `location` when empty). With `location_split`, a
+    {location: share} dict from parse_location_split, each item's stock is divided across the
+    locations. Both multi-location modes produce all rows in one pass, grouped by location and
+    sorted by product.
+    """
+    # Keep location codes such as 101 as written rather than letting pandas parse them as numbers
+    read_options = {'dtype': {location_column: str}} if location_column else {}
     if file_type == 'csv':
-        df = pd.read_csv(io.StringIO(file_content.decode('utf-8-sig')))
+        df = pd.read_csv(io.StringIO(file_content.decode('utf-8-sig')), **read_options)
     elif file_type == 'xlsx':
-        df = pd.read_excel(io.BytesIO(file_content))
+        df = pd.read_excel(io.BytesIO(file_content), **read_options)
     else:
         raise ValueError("Unsupported file type")
 
-    stock_move_data = []
+    if location_column and location_split:
+        raise ValueError("Use either a location column or a location split, not both")
+    if location_column and location_column not in df.columns:
+        raise ValueError(f"Location column '{location_column}' not found in the file")
+
+    multi_location = bool(location_column or location_split)
+    total_share = sum(location_split.values()) if location_split else 0
+    row_locations = df[location_column] if location_column else itertools.repeat(location)
+
+    moves_by_location = {}
+    location_suffixes = {}
 
-    for _, row in df.iterrows():
-        if int(row['Stock']) > 0:
-            item_sku = row['Item SKU']
-            stock_move_data.append({
-                'external_id': f"stock_{item_sku.replace('-', '_')}",
+    for item_sku, stock, row_location in zip(df['Item SKU'], df['Stock'], row_locations):
+        stock = int(stock)
+        if stock <= 0:
+            continue
+
+        if location_split:
+            allocation = split_quantity(stock, location_split, total_share)
+        else:
+            if not pd.isna(row_location) and str(row_location).strip():
+                row_location = str(row_location).strip()
+            elif location:
+                row_location = location
+            else:
+                raise ValueError(f"No location given for item {item_sku}")
+            allocation = {row_location: stock}
+
+        for move_location, quantity in allocation.items():
+            if quantity <= 0:
+                continue
+            external_id = f"stock_{item_sku.replace('-', '_')}"
+            if multi_location:
+                # The same item can be counted in several locations, so the ID must name the location
+                suffix = location_suffix(move_location)
+                other_location = location_suffixes.setdefault(suffix, move_location)
+                if other_location != move_location:
+                    raise ValueError(f"Locations '{other_location}' and '{move_location}' would produce the same external IDs")
+                external_id += f"_{suffix}"
+            moves_by_location.setdefault(move_location, []).append({
+                'external_id': external_id,
                 'Product/external_id': f"product_{item_sku.replace('-', '_')}",
                 'Product': item_sku,
-                'Location': location,
+                'Location': move_location,
                 'Quantity (On Hand)': 0,
-                'Counted Quantity': int(row['Stock']),
+                'Counted Quantity': quantity,
                 'Difference': 0,
                 'Scheduled Date': '',
                 'Assigned To': 'Administrator'
             })
 
-    return pd.DataFrame(stock_move_data)
\ No newline at end of file
+    if not multi_location:
+        # A single location keeps the rows in file order
+        return pd.DataFrame([move for moves in moves_by_location.values() for move in moves])
+
+    stock_move_data = []
+    for move_location in sorted(moves_by_location):
+        stock_move_data.extend(sorted(moves_by_location[move_location], key=lambda move: move['Product']))
+    return pd.DataFrame(stock_move_data)
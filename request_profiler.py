@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import uuid
+import threading
+from collections import Counter
+
+
+class SamplingProfiler:
+    """Samples the call stack of the thread that created it at a fixed interval.
+
+    Use as a context manager around the code to profile. The result is written in the
+    collapsed stack format ("frame;frame;frame count" per line), which speedscope and
+    flamegraph.pl both open directly.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self.duration = 0.0
+        self._target_thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = None
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.monotonic() - self._start
+        return False
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target_thread_id)
+            if frame is not None:
+                self.samples[self._collapse(frame)] += 1
+
+    @staticmethod
+    def _collapse(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def collapsed(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+def save_profile(profiler, directory, label, retention):
+    """Write a profile to `directory`, keeping only the `retention` most recent ones. Returns the file name."""
+    os.makedirs(directory, exist_ok=True)
+    filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{label}-{uuid.uuid4().hex[:8]}.folded"
+    with open(os.path.join(directory, filename), 'w') as f:
+        f.write(profiler.collapsed())
+
+    profiles = sorted(
+        (entry for entry in os.scandir(directory) if entry.is_file() and entry.name.endswith('.folded')),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True
+    )
+    for entry in profiles[retention:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+    return filename
@@ -15,6 +15,9 @@ document.addEventListener('DOMContentLoaded', function() {
     const locationForm = document.getElementById('locationForm');
     const stockMoveErrorMessage = document.getElementById('stockMoveErrorMessage');
 
+    // Leading part of a CSV sent to /get_product_info; the modal only needs the header and first rows
+    const PREVIEW_BYTES = 256 * 1024;
+
     generateStockMoveButton.addEventListener('click', function(e) {
         e.preventDefault();
         locationModal.style.display = 'block';
@@ -24,6 +27,8 @@ document.addEventListener('DOMContentLoaded', function() {
         e.preventDefault();
         const formData = new FormData(stockMoveForm);
         formData.append('location', document.getElementById('locationSelect').value);
+        formData.append('location_split', document.getElementById('locationSplit').value);
+        formData.append('location_column', document.getElementById('locationColumn').value);
 
         fetch('/generate_stock_move', {
             method: 'POST',
@@ -64,6 +69,13 @@ document.addEventListener('DOMContentLoaded', function() {
         errorMessage.style.display = 'block';
     }
 
+    function formatValidationErrors(error) {
+        const lines = (error.validation_errors || []).slice(0, 10).map(
+            rowError => `Line ${rowError.line}: ${rowError.reasons.join('; ')}`
+        );
+        return [error.error || 'An error occurred', ...lines].join('\n');
+    }
+
     function clearError() {
         errorMessage.textContent = '';
         errorMessage.style.display = 'none';
@@ -107,6 +119,11 @@ document.addEventListener('DOMContentLoaded', function() {
         e.preventDefault();
         clearError();
         const formData = new FormData(this);
+        const file = fileInput.files[0];
+        if (file && !file.name.match(/\.(xlsx|xls)$/i) && file.size > PREVIEW_BYTES) {
+            formData.set('file', file.slice(0, PREVIEW_BYTES), file.name);
+            formData.set('partial', '1');
+        }
 
         fetch('/get_product_info', {
             method: 'POST',
@@ -168,7 +185,8 @@ document.addEventListener('DOMContentLoaded', function() {
             window.URL.revokeObjectURL(url);
         })
         .catch(error => {
-            errorMessage.textContent = error.error || 'An error occurred';
+            errorMessage.textContent = formatValidationErrors(error);
+            errorMessage.style.display = 'block';
         });
     });
 
@@ -0,0 +1,265 @@
+import io
+import os
+import threading
+import time
+
+import pytest
+
+import app as app_module
+from app import AdmissionController, send_artifact
+from artifact_cache import ArtifactCache
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not met in time")
+        time.sleep(0.005)
+
+
+class RecordingController(AdmissionController):
+    """Records the cost of each admitted request, in admission order."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.admitted_costs = []
+
+    def _admit(self, cost, waited):
+        self.admitted_costs.append(cost)
+        super()._admit(cost, waited)
+
+
+def acquire_in_thread(controller, cost, results):
+    thread = threading.Thread(target=lambda: results.append((cost, controller.acquire(cost))))
+    thread.start()
+    return thread
+
+
+def test_admission_is_first_in_first_out():
+    controller = RecordingController(100, max_queue=4, max_wait=5)
+    assert controller.acquire(60)
+
+    results = []
+    large = acquire_in_thread(controller, 50, results)
+    wait_until(lambda: controller.metrics()['queue_depth'] == 1)
+    # 10 bytes would fit right away, but must not overtake the request ahead of it
+    small = acquire_in_thread(controller, 10, results)
+    wait_until(lambda: controller.metrics()['queue_depth'] == 2)
+    time.sleep(0.05)
+    assert controller.admitted_costs == [60]
+
+    controller.release(60)
+    large.join()
+    small.join()
+    assert controller.admitted_costs == [60, 50, 10]
+    assert sorted(results) == [(10, True), (50, True)]
+
+
+def test_full_queue_is_rejected_immediately():
+    controller = AdmissionController(100, max_queue=1, max_wait=5)
+    assert controller.acquire(100)
+    results = []
+    queued = acquire_in_thread(controller, 10, results)
+    wait_until(lambda: controller.metrics()['queue_depth'] == 1)
+
+    start = time.monotonic()
+    assert not controller.acquire(10)
+    assert time.monotonic() - start < 1
+
+    controller.release(100)
+    queued.join()
+    assert results == [(10, True)]
+    assert controller.metrics()['rejected_total'] == 1
+
+
+def test_timed_out_request_reserves_nothing():
+    controller = AdmissionController(100, max_queue=4, max_wait=0.1)
+    assert controller.acquire(80)
+
+    start = time.monotonic()
+    assert not controller.acquire(50)
+    assert time.monotonic() - start >= 0.1
+
+    metrics = controller.metrics()
+    assert metrics['in_use_bytes'] == 80
+    assert metrics['queue_depth'] == 0
+    controller.release(80)
+    assert controller.metrics()['in_use_bytes'] == 0
+    assert controller.acquire(100)
+
+
+def test_request_larger_than_budget_waits_for_an_idle_server():
+    controller = AdmissionController(100, max_queue=4, max_wait=5)
+    assert controller.acquire(30)
+
+    results = []
+    oversized = acquire_in_thread(controller, 500, results)
+    wait_until(lambda: controller.metrics()['queue_depth'] == 1)
+    time.sleep(0.05)
+    assert results == []
+
+    controller.release(30)
+    oversized.join()
+    assert results == [(500, True)]
+    assert controller.metrics()['in_use_bytes'] == 100
+    controller.release(500)
+    assert controller.metrics()['in_use_bytes'] == 0
+
+
+def test_metrics_count_admissions_rejections_and_waits():
+    controller = AdmissionController(100, max_queue=1, max_wait=5)
+    assert controller.acquire(100)
+    results = []
+    queued = acquire_in_thread(controller, 20, results)
+    wait_until(lambda: controller.metrics()['queue_depth'] == 1)
+    assert not controller.acquire(20)
+    time.sleep(0.05)
+    controller.release(100)
+    queued.join()
+
+    metrics = controller.metrics()
+    assert metrics['budget_bytes'] == 100
+    assert metrics['admitted_total'] == 2
+    assert metrics['rejected_total'] == 1
+    assert metrics['max_queue_depth'] == 1
+    assert metrics['active_requests'] == 1
+    assert metrics['in_use_bytes'] == 20
+    assert metrics['max_wait_seconds'] >= 0.05
+    assert metrics['average_wait_seconds'] == pytest.approx(metrics['max_wait_seconds'] / 2)
+
+
+def test_busy_server_answers_503_with_retry_after(monkeypatch):
+    controller = AdmissionController(100, max_queue=0, max_wait=0)
+    assert controller.acquire(100)
+    monkeypatch.setattr(app_module, 'admission_controller', controller)
+
+    response = app_module.app.test_client().post('/process', data={
+        'file': (io.BytesIO(b'Product SKU\n'), 'inventory.csv'),
+        'product_name': 'Tee',
+        'product_sku_base': 'TEE'
+    })
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(app_module.app.config['ADMISSION_RETRY_AFTER'])
+    assert 'error' in response.get_json()
+
+
+INVENTORY_CSV = (
+    'Product SKU,Product Name,Price,MPN,Stock,GTIN,Status\n'
+    'ABC,Tee Red,€10,,,,active\n'
+    'ABC-XS,Tee Red [S]Size=XS,,MPN001,3,,active\n'
+).encode()
+
+PROCESSED_CSV = (
+    'Product,Item,Item SKU,Color,Size,Stock,MPN,GTIN,Price,Status\n'
+    'Tee,Tee Red XS,TEE-001-XS,Red,XSmall,3,MPN001,,10,active\n'
+).encode()
+
+PROCESS_FORM = {
+    'product_name': 'Tee',
+    'product_sku_base': 'TEE',
+    'default_price': '0',
+    'wholesale_price': '0',
+    'consignment_price': '0',
+    'cost': '0',
+    'weight': '0',
+    'brand': 'Tavi',
+    'gender': 'Unisex',
+    'suppliers': 'SISSEL',
+    'sheet_name': '',
+    'output_format': 'csv'
+}
+
+
+@pytest.fixture
+def artifact_cache(tmp_path, monkeypatch):
+    cache = ArtifactCache(str(tmp_path), 10 * 1024 * 1024)
+    monkeypatch.setattr(app_module, 'artifact_cache', cache)
+    return cache
+
+
+def post(route, content, filename, form):
+    return app_module.app.test_client().post(route, data={'file': (io.BytesIO(content), filename), **form})
+
+
+def test_cache_hit_skips_build(artifact_cache):
+    calls = []
+
+    def build():
+        calls.append(True)
+        return b'artifact'
+
+    with app_module.app.test_request_context('/process', method='POST'):
+        for _ in range(2):
+            response = send_artifact('0' * 64, build, 'csv', 'processed_inventory.csv')
+            response.direct_passthrough = False
+            assert response.get_data() == b'artifact'
+            assert response.headers['ETag'] == f'"{"0" * 64}"'
+            response.close()
+    assert calls == [True]
+
+
+def test_repeated_request_is_served_from_cache(artifact_cache, monkeypatch):
+    first = post('/process', INVENTORY_CSV, 'inventory.csv', PROCESS_FORM)
+    assert first.status_code == 200
+
+    def fail(*args, **kwargs):
+        raise AssertionError("process_file should not run on a cache hit")
+    monkeypatch.setattr(app_module, 'process_file', fail)
+
+    second = post('/process', INVENTORY_CSV, 'inventory.csv', PROCESS_FORM)
+    assert second.status_code == 200
+    assert second.data == first.data
+    assert second.headers['ETag'] == first.headers['ETag']
+
+
+@pytest.mark.parametrize('route, content, base_form, changes', [
+    ('/process', INVENTORY_CSV, PROCESS_FORM, {
+        'product_name': 'Sock',
+        'product_sku_base': 'SOCK',
+        'default_price': '5',
+        'wholesale_price': '5',
+        'consignment_price': '5',
+        'cost': '5',
+        'weight': '5',
+        'brand': 'Toesox',
+        'gender': 'Female',
+        'suppliers': 'Thirty Three Threads',
+        'sheet_name': 'Sheet2',
+        'output_format': 'xlsx'
+    }),
+    ('/convert_to_odoo', PROCESSED_CSV, {'primaryCategory': 'socks', 'output_format': 'csv'}, {
+        'primaryCategory': 'shirts',
+        'secondaryCategory': 'men',
+        'tertiaryCategory': 'summer',
+        'output_format': 'xlsx'
+    }),
+    ('/generate_stock_move', PROCESSED_CSV, {'location': 'KALLI/Stock', 'output_format': 'csv'}, {
+        'location': 'AGDM1/Stock',
+        'location_split': 'KALLI/Stock=50, AGDM1/Stock=50',
+        'output_format': 'xlsx'
+    })
+])
+def test_cache_key_changes_with_each_output_shaping_field(artifact_cache, route, content, base_form, changes):
+    base = post(route, content, 'inventory.csv', base_form)
+    assert base.status_code == 200
+    etags = {base.headers['ETag']}
+    for field, value in changes.items():
+        response = post(route, content, 'inventory.csv', {**base_form, field: value})
+        assert response.status_code == 200, field
+        assert response.headers['ETag'] not in etags, field
+        etags.add(response.headers['ETag'])
+
+
+def test_category_case_does_not_change_the_cache_key(artifact_cache):
+    lower = post('/convert_to_odoo', PROCESSED_CSV, 'inventory.csv', {'primaryCategory': 'socks'})
+    upper = post('/convert_to_odoo', PROCESSED_CSV, 'inventory.csv', {'primaryCategory': 'SOCKS'})
+    assert lower.headers['ETag'] == upper.headers['ETag']
+
+
+def test_validation_error_is_not_cached(artifact_cache, tmp_path):
+    invalid_csv = INVENTORY_CSV.replace(b',3,', b',x,')
+    response = post('/process', invalid_csv, 'inventory.csv', PROCESS_FORM)
+    assert response.status_code == 400
+    assert response.get_json()['validation_errors'] == [{'line': 3, 'reasons': ["Stock must be a whole number, got 'x'"]}]
+    assert os.listdir(tmp_path) == []
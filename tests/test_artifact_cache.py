@@ -0,0 +1,51 @@
+import os
+
+from artifact_cache import ArtifactCache, make_cache_key
+
+
+def read(cache, key):
+    f = cache.open(key)
+    if f is None:
+        return None
+    with f:
+        return f.read()
+
+
+def test_put_then_open_returns_the_stored_bytes(tmp_path):
+    cache = ArtifactCache(str(tmp_path), 1024)
+    assert read(cache, 'a') is None
+    cache.put('a', b'artifact')
+    assert read(cache, 'a') == b'artifact'
+
+
+def test_least_recently_used_artifact_is_evicted_first(tmp_path):
+    cache = ArtifactCache(str(tmp_path), 25)
+    cache.put('a', b'a' * 10)
+    cache.put('b', b'b' * 10)
+    os.utime(tmp_path / 'a', (1000, 1000))
+    os.utime(tmp_path / 'b', (2000, 2000))
+    # Reading 'a' makes 'b' the least recently used
+    assert read(cache, 'a') == b'a' * 10
+
+    cache.put('c', b'c' * 10)
+    assert sorted(os.listdir(tmp_path)) == ['a', 'c']
+
+
+def test_artifact_larger_than_the_cache_is_not_stored(tmp_path):
+    cache = ArtifactCache(str(tmp_path), 5)
+    cache.put('a', b'a' * 10)
+    assert os.listdir(tmp_path) == []
+
+
+def test_zero_size_cache_stores_nothing(tmp_path):
+    cache = ArtifactCache(str(tmp_path / 'cache'), 0)
+    cache.put('a', b'artifact')
+    assert read(cache, 'a') is None
+    assert not (tmp_path / 'cache').exists()
+
+
+def test_cache_key_depends_on_content_and_params():
+    key = make_cache_key(b'content', {'output_format': 'csv'})
+    assert key == make_cache_key(b'content', {'output_format': 'csv'})
+    assert key != make_cache_key(b'other content', {'output_format': 'csv'})
+    assert key != make_cache_key(b'content', {'output_format': 'xlsx'})
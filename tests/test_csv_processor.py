@@ -0,0 +1,144 @@
+import io
+import re
+import zipfile
+
+import pytest
+from openpyxl import Workbook
+
+from csv_processor import process_file, get_initial_product_info, generate_stock_move, ValidationError
+
+
+HEADER = 'Product SKU,Product Name,Price,MPN,Stock,GTIN,Status\n'
+
+
+def run_process(content):
+    return process_file(content.encode(), 'csv', 'Tee', 'TEE', '0', '0', '0', '0', '0', '', '', '')
+
+
+def test_validation_reports_physical_line_numbers():
+    content = (
+        HEADER
+        + 'ABC,"Tee Red\nStripe",€10,,,,active\n'
+        + '\n'
+        + '\n'
+        + 'ABC-XS,Tee Red [S]Size=XS,,MPN001,x,,active\n'
+    )
+    with pytest.raises(ValidationError) as excinfo:
+        run_process(content)
+    assert [error['line'] for error in excinfo.value.errors] == [6]
+
+
+def test_validation_rejects_product_without_items():
+    content = (
+        HEADER
+        + 'ABC,Tee Red,€10,,,,active\n'
+        + 'ABC-XS,Tee Red [S]Size=XS,,MPN001,3,,active\n'
+        + 'DEF,Tee Blue,€10,,,,active\n'
+    )
+    with pytest.raises(ValidationError) as excinfo:
+        run_process(content)
+    assert excinfo.value.errors == [{'line': 4, 'reasons': ['Product has no item rows']}]
+
+
+def test_validation_accepts_short_mpn():
+    content = (
+        HEADER
+        + 'ABC,Tee Red,€10,,,,active\n'
+        + 'ABC-XS,Tee Red [S]Size=XS,,MP,3,,active\n'
+    )
+    processed_data = run_process(content)
+    assert 'TEE-MP-XS' in processed_data['ABC']['Items']
+
+
+STOCK_HEADER = 'Item SKU,Stock,Loc\n'
+
+
+def test_stock_move_keeps_numeric_location_codes():
+    content = STOCK_HEADER + 'TEE-RED-XS,3,101\nTEE-RED-SM,2,102\nTEE-RED-MD,1,\n'
+    stock_move_data = generate_stock_move(content.encode(), 'csv', 'KALLI/Stock', location_column='Loc')
+    assert sorted(zip(stock_move_data['Product'], stock_move_data['Location'])) == [
+        ('TEE-RED-MD', 'KALLI/Stock'),
+        ('TEE-RED-SM', '102'),
+        ('TEE-RED-XS', '101')
+    ]
+
+
+def test_stock_move_rejects_locations_with_clashing_ids():
+    content = STOCK_HEADER + 'TEE-RED-XS,3,WH/Stock\nTEE-RED-XS,2,WH_Stock\n'
+    with pytest.raises(ValueError, match='same external IDs'):
+        generate_stock_move(content.encode(), 'csv', location_column='Loc')
+
+
+def build_workbook(rows, dimension=None):
+    wb = Workbook()
+    ws = wb.active
+    for row in rows:
+        ws.append(row)
+    output = io.BytesIO()
+    wb.save(output)
+    if dimension is None:
+        return output.getvalue()
+
+    # Rewrite the stored sheet dimension the way some exporters leave it
+    source = zipfile.ZipFile(io.BytesIO(output.getvalue()))
+    patched = io.BytesIO()
+    with zipfile.ZipFile(patched, 'w') as target:
+        for info in source.infolist():
+            data = source.read(info.filename)
+            if info.filename == 'xl/worksheets/sheet1.xml':
+                data = re.sub(rb'<dimension ref="[^"]*"', f'<dimension ref="{dimension}"'.encode(), data)
+            target.writestr(info, data)
+    return patched.getvalue()
+
+
+EXCEL_ROWS = [
+    ['Product SKU', 'Product Name', 'Price', 'MPN', 'Stock', 'GTIN', 'Status'],
+    ['ABC', 'Tee Red', '€10', None, None, None, 'active'],
+    ['ABC-XS', 'Tee Red [S]Size=XS', None, 'MPN001', 1],
+    ['ABC-SM', 'Tee Red [S]Size=SM', None, 'MPN001', 2]
+]
+
+
+def test_process_excel_ignores_stale_dimension():
+    content = build_workbook(EXCEL_ROWS, dimension='A1:G3')
+    processed_data = process_file(content, 'xlsx', 'Tee', 'TEE', '0', '0', '0', '0', '0', '', '', '')
+    assert processed_data['ABC']['Items']['TEE-001-SM']['Stock'] == 2
+
+
+def test_excel_product_info_ignores_stale_dimension():
+    content = build_workbook(EXCEL_ROWS, dimension='A1:A2')
+    product_info = get_initial_product_info(content, 'xlsx')
+    assert product_info['product_name'] == 'Tee'
+    assert product_info['product_sku_base'] == 'ABC'
+    assert product_info['columns'] == EXCEL_ROWS[0]
+    assert len(product_info['sample_rows']) == 3
+
+
+PREVIEW_CSV = (
+    HEADER
+    + 'ABC,"Tee Red\nStripe",€10,,,,active\n'
+    + 'ABC-XS,Tee Red [S]Size=XS,,MPN001,1,,active\n'
+    + 'ABC-SM,Tee Red [S]Size=SM,,MPN001,2,,active\n'
+).encode()
+
+
+def test_partial_product_info_drops_record_cut_inside_quoted_cell():
+    cut = PREVIEW_CSV.index(b'Stripe')
+    with pytest.raises(Exception, match='No complete data row'):
+        get_initial_product_info(PREVIEW_CSV[:cut], 'csv', partial=True)
+
+
+def test_partial_product_info_uses_only_complete_rows():
+    # The cut falls in the ABC-SM line; ABC-XS is dropped too, as it could have been cut inside a quoted cell
+    cut = PREVIEW_CSV.index(b'Size=SM')
+    product_info = get_initial_product_info(PREVIEW_CSV[:cut], 'csv', partial=True)
+    assert product_info['product_sku_base'] == 'ABC'
+    assert product_info['sample_rows'] == [{
+        'Product SKU': 'ABC', 'Product Name': 'Tee Red\nStripe', 'Price': '€10',
+        'MPN': '', 'Stock': '', 'GTIN': '', 'Status': 'active'
+    }]
+
+
+def test_partial_product_info_reports_truncated_header():
+    with pytest.raises(Exception, match='header line is longer'):
+        get_initial_product_info(PREVIEW_CSV[:20], 'csv', partial=True)